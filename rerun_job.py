@@ -20,36 +20,90 @@ Usage Examples:
     
     # Monitor job execution
     python rerun_job.py --job-name myjob --namespace <namespace> --env-var-name <var_name> --env-var-value <value> --monitor
+    
+    # Rerun and monitor several jobs at once
+    python rerun_job.py --job-name myjob otherjob --namespace <namespace> --monitor
 """
 
 import argparse
-from curses import meta
-import subprocess
+import json
+import random
 import sys
+import time
 import yaml
-import json
-import tempfile
-import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import MaxRetryError, ProtocolError, ReadTimeoutError
+
+try:
+    from yaml import CSafeDumper as _Dumper
+except ImportError as e:
+    raise ImportError(
+        "PyYAML was built without libyaml support. Reinstall it with libyaml available, e.g. "
+        "'pip install --force-reinstall --no-binary pyyaml pyyaml' after installing libyaml-dev"
+    ) from e
 
 
-def run_kubectl_command(args: list, capture_output: bool = True) -> subprocess.CompletedProcess:
-    """Run a kubectl command and return the result."""
+# Shared API client, created once per run and reused for every request
+_api_client: Optional[client.ApiClient] = None
+
+
+def load_cluster_config() -> client.ApiClient:
+    """Load the cluster configuration and create the shared API client.
+    
+    Credentials (including any kubeconfig exec auth plugin) are resolved here once;
+    every API call afterwards reuses the same client and its connection pool.
+    """
+    global _api_client
+    # Same precedence as kubectl: KUBECONFIG / ~/.kube/config first, in-cluster only without one
     try:
-        result = subprocess.run(['kubectl'] + args, capture_output=capture_output, text=True, check=True)
-        return result
-    except subprocess.CalledProcessError as e:
-        print(f"Error running kubectl command: {' '.join(['kubectl'] + args)}")
-        print(f"Error: {e}")
-        sys.exit(1)
+        config.load_kube_config()
+    except config.ConfigException:
+        config.load_incluster_config()
+    _api_client = client.ApiClient()
+    return _api_client
+
+
+def get_api_client() -> client.ApiClient:
+    """Return the shared API client, loading the cluster configuration on first use."""
+    if _api_client is None:
+        return load_cluster_config()
+    return _api_client
+
+
+def get_batch_api() -> client.BatchV1Api:
+    """Return a BatchV1Api bound to the shared API client."""
+    return client.BatchV1Api(get_api_client())
+
+
+def format_api_error(error: ApiException) -> str:
+    """Return the API error status and reason, plus the server's message when it sent one."""
+    summary = f"{error.status} {error.reason}"
+    try:
+        message = json.loads(error.body).get('message') if error.body else None
+    except (ValueError, AttributeError):
+        message = None
+    return f"{summary}: {message}" if message else summary
+
+
+def initial_backoff_delay() -> float:
+    """Return the first retry delay: 0.5s with +/-10% jitter."""
+    return 0.5 * random.uniform(0.9, 1.1)
+
+
+def next_backoff_delay(delay: float, max_delay: float = 30) -> float:
+    """Grow a retry delay by 1.5x with +/-10% jitter, kept between 0.5s and max_delay."""
+    return max(0.5, min(max_delay, delay * 1.5 * random.uniform(0.9, 1.1)))
 
 
 def get_job_manifest(job_name: str, namespace: str) -> Dict[str, Any]:
     """Get the current job manifest from Kubernetes."""
     print(f"Getting manifest for job '{job_name}' in namespace '{namespace}'...")
     
-    result = run_kubectl_command(['get', 'job', job_name, '-n', namespace, '-o', 'yaml'])
-    return yaml.safe_load(result.stdout)
+    job = get_batch_api().read_namespaced_job(job_name, namespace)
+    return get_api_client().sanitize_for_serialization(job)
 
 
 def update_job_manifest(manifest: Dict[str, Any], env_var_name: str = None, env_var_value: str = None) -> Dict[str, Any]:
@@ -75,17 +129,18 @@ def update_job_manifest(manifest: Dict[str, Any], env_var_name: str = None, env_
     
     # Update environment variable if specified
     if env_var_name and env_var_value:
-        env_vars = container.get('env', [])
-        target_env_var = None
+        env_vars = container.setdefault('env', [])
         
         # Find the specified environment variable
-        for env_var in env_vars:
-            if env_var['name'] == env_var_name:
-                target_env_var = env_var
-                break
+        env_index = {env_var['name']: env_var for env_var in env_vars}
+        target_env_var = env_index.get(env_var_name)
         
         if target_env_var:
-            current_value = target_env_var['value']
+            # A literal value can't be combined with valueFrom; fail before any job is deleted
+            if 'valueFrom' in target_env_var:
+                raise ValueError(f"Environment variable {env_var_name} is set via valueFrom and cannot be "
+                                 "updated with a literal value")
+            current_value = target_env_var.get('value', '')
             # Check if the value already exists (for space-separated values)
             if ' ' in current_value:
                 values_list = current_value.split()
@@ -101,7 +156,7 @@ def update_job_manifest(manifest: Dict[str, Any], env_var_name: str = None, env_
         else:
             # Environment variable doesn't exist, add it
             new_env_var = {'name': env_var_name, 'value': env_var_value}
-            container['env'].append(new_env_var)
+            env_vars.append(new_env_var)
             print(f"Added new environment variable {env_var_name} with value '{env_var_value}'")
     
     # Clean up metadata for recreation
@@ -112,6 +167,7 @@ def update_job_manifest(manifest: Dict[str, Any], env_var_name: str = None, env_
         metadata.pop('resourceVersion', None)
         metadata.pop('uid', None)
         metadata.pop('generation', None)
+        metadata.pop('managedFields', None)
         metadata.pop('labels',None)
         metadata = manifest['spec']['template']['metadata']
         metadata.pop('labels',None)
@@ -131,67 +187,122 @@ def update_job_manifest(manifest: Dict[str, Any], env_var_name: str = None, env_
 
 
 def delete_job(job_name: str, namespace: str) -> None:
-    """Delete the existing job."""
+    """Delete the existing job without waiting for its pods to terminate."""
     print(f"Deleting existing job '{job_name}'...")
-    run_kubectl_command(['delete', 'job', job_name, '-n', namespace], capture_output=False)
+    
+    # Background propagation lets the garbage collector remove the old pods asynchronously
+    get_batch_api().delete_namespaced_job(job_name, namespace, propagation_policy='Background',
+                                          grace_period_seconds=0)
+    print(f"job.batch \"{job_name}\" deleted")
 
 
-def apply_job_manifest(manifest: Dict[str, Any], namespace: str) -> None:
-    """Apply the updated job manifest."""
+def apply_job_manifest(manifest: Dict[str, Any], namespace: str, max_attempts: int = 10) -> None:
+    """Apply the updated job manifest, retrying while the old job is still being removed."""
     print(f"Applying updated job manifest to namespace '{namespace}'...")
     
-    # Convert to YAML
-    yaml_content = yaml.dump(manifest, default_flow_style=False)
+    batch = get_batch_api()
+    delay = initial_backoff_delay()
+    for attempt in range(1, max_attempts + 1):
+        try:
+            batch.create_namespaced_job(namespace, manifest)
+            break
+        except ApiException as e:
+            # 409 Conflict means the deleted job has not been removed yet
+            if e.status != 409 or attempt == max_attempts:
+                raise
+            print(f"Previous job still exists, retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            delay = next_backoff_delay(delay, max_delay=10)
     
-    # Create a temporary file to store the manifest
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as temp_file:
-        temp_file.write(yaml_content)
-        temp_file_path = temp_file.name
-    
-    try:
-        # Apply using kubectl with the temporary file
-        result = run_kubectl_command(['apply', '-f', temp_file_path, '-n', namespace], capture_output=False)
-        print("Job manifest applied successfully")
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+    print("Job manifest applied successfully")
 
 
-def check_job_status(job_name: str, namespace: str, timeout_minutes: int = 10) -> None:
-    """Check and monitor job status."""
+def check_job_status(job_names: List[str], namespace: str, timeout_minutes: int = 10) -> None:
+    """Check and monitor the status of one or more jobs through a single watch."""
     print(f"Monitoring job status for up to {timeout_minutes} minutes...")
     
-    import time
+    batch = get_batch_api()
     start_time = time.time()
     timeout_seconds = timeout_minutes * 60
+    resource_version = None
+    # The job controller labels every job with its own name, so one selector covers them all
+    label_selector = f"job-name in ({','.join(job_names)})"
+    pending = set(job_names)
+    reconnect_delay = initial_backoff_delay()
     
-    while time.time() - start_time < timeout_seconds:
-        result = run_kubectl_command(['get', 'job', job_name, '-n', namespace, '-o', 'json'])
-        job_status = json.loads(result.stdout)
-        
-        status = job_status.get('status', {})
-        completions = status.get('succeeded', 0)
-        failed = status.get('failed', 0)
-        active = status.get('active', 0)
-        
-        print(f"Status: {completions} completed, {failed} failed, {active} active")
+    while pending:
+        remaining_seconds = int(timeout_seconds - (time.time() - start_time))
+        if remaining_seconds <= 0:
+            break
         
-        if completions > 0:
-            print("✅ Job completed successfully!")
-            return
-        elif failed > 0:
-            print("❌ Job failed!")
-            return
-        
-        time.sleep(10)
+        job_watch = watch.Watch()
+        try:
+            # The first (unversioned) watch replays the current state as ADDED events.
+            # The client-side read timeout guards against connections that die silently;
+            # bookmarks keep the resourceVersion fresh while the jobs are idle.
+            for event in job_watch.stream(batch.list_namespaced_job, namespace,
+                                          label_selector=label_selector,
+                                          resource_version=resource_version,
+                                          allow_watch_bookmarks=True,
+                                          timeout_seconds=remaining_seconds,
+                                          _request_timeout=(10, remaining_seconds + 30)):
+                resource_version = event['raw_object']['metadata']['resourceVersion']
+                reconnect_delay = initial_backoff_delay()
+                if event['type'] == 'BOOKMARK':
+                    continue
+                
+                job = event['object']
+                job_name = job.metadata.name
+                if job_name not in pending:
+                    continue
+                
+                if event['type'] == 'DELETED':
+                    print(f"❌ Job '{job_name}' was deleted!")
+                    pending.discard(job_name)
+                else:
+                    status = job.status
+                    completions = status.succeeded or 0
+                    failed = status.failed or 0
+                    active = status.active or 0
+                    
+                    print(f"Status of '{job_name}': {completions} completed, {failed} failed, {active} active")
+                    
+                    if completions > 0:
+                        print(f"✅ Job '{job_name}' completed successfully!")
+                        pending.discard(job_name)
+                    elif failed > 0:
+                        print(f"❌ Job '{job_name}' failed!")
+                        pending.discard(job_name)
+                
+                if not pending:
+                    return
+        except ApiException as e:
+            if e.status == 410:
+                # Our resourceVersion is too old, start over from the current state
+                resource_version = None
+            elif e.status in (401, 403):
+                raise
+            else:
+                # Never sleep past the monitoring deadline
+                sleep_seconds = min(reconnect_delay, max(0, timeout_seconds - (time.time() - start_time)))
+                print(f"Watch interrupted ({e.status} {e.reason}), reconnecting in {sleep_seconds:.1f}s...")
+                time.sleep(sleep_seconds)
+                reconnect_delay = next_backoff_delay(reconnect_delay)
+        except (ProtocolError, ReadTimeoutError, MaxRetryError):
+            sleep_seconds = min(reconnect_delay, max(0, timeout_seconds - (time.time() - start_time)))
+            print(f"Watch connection dropped, reconnecting in {sleep_seconds:.1f}s...")
+            time.sleep(sleep_seconds)
+            reconnect_delay = next_backoff_delay(reconnect_delay)
+        finally:
+            job_watch.stop()
     
-    print(f"⏰ Timeout reached ({timeout_minutes} minutes). Job may still be running.")
+    if pending:
+        print(f"⏰ Timeout reached ({timeout_minutes} minutes). Jobs may still be running: {', '.join(sorted(pending))}")
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Update and rerun a Kubernetes job with latest image and environment variable')
-    parser.add_argument('--job-name', required=True, help='Name of the job to update')
+    parser = argparse.ArgumentParser(description='Update and rerun one or more Kubernetes jobs with latest image and environment variable')
+    parser.add_argument('--job-name', dest='job_names', metavar='JOB_NAME', nargs='+', required=True, help='Name(s) of the job(s) to update')
     parser.add_argument('--namespace', required=True, help='Namespace of the job')
     parser.add_argument('--env-var-name', required=False, help='Name of the environment variable to update (e.g., CUSTOMER_INDEXES)')
     parser.add_argument('--env-var-value', required=False, help='Value to set for the environment variable')
@@ -210,7 +321,7 @@ def main():
         sys.exit(1)
     
     print(f"🚀 Starting job update process...")
-    print(f"Job: {args.job_name}")
+    print(f"Jobs: {', '.join(args.job_names)}")
     print(f"Namespace: {args.namespace}")
     if args.env_var_name and args.env_var_value:
         print(f"Environment Variable: {args.env_var_name} = {args.env_var_value}")
@@ -220,30 +331,38 @@ def main():
     print("-" * 50)
     
     try:
-        # Get current job manifest
-        manifest = get_job_manifest(args.job_name, args.namespace)
+        # Load cluster credentials once for the whole run
+        load_cluster_config()
         
-        # Update manifest
-        updated_manifest = update_job_manifest(manifest, args.env_var_name, args.env_var_value)
+        # Get and update every job manifest before touching any job
+        updated_manifests = {}
+        for job_name in args.job_names:
+            manifest = get_job_manifest(job_name, args.namespace)
+            updated_manifests[job_name] = update_job_manifest(manifest, args.env_var_name, args.env_var_value)
         
         if args.dry_run:
-            print("\n📋 DRY RUN - Updated manifest:")
-            print(yaml.dump(updated_manifest, default_flow_style=False))
+            for job_name, updated_manifest in updated_manifests.items():
+                print(f"\n📋 DRY RUN - Updated manifest for '{job_name}':")
+                print(yaml.dump(updated_manifest, default_flow_style=False, Dumper=_Dumper))
             print("Dry run completed. No changes were made.")
             return
         
-        # Delete existing job
-        delete_job(args.job_name, args.namespace)
-        
-        # Apply updated manifest
-        apply_job_manifest(updated_manifest, args.namespace)
-        
-        print(f"\n✅ Job '{args.job_name}' has been successfully updated and started!")
+        for job_name, updated_manifest in updated_manifests.items():
+            # Delete existing job
+            delete_job(job_name, args.namespace)
+            
+            # Apply updated manifest
+            apply_job_manifest(updated_manifest, args.namespace)
+            
+            print(f"\n✅ Job '{job_name}' has been successfully updated and started!")
         
         # Monitor job status if requested
         if args.monitor:
-            check_job_status(args.job_name, args.namespace, args.timeout)
+            check_job_status(args.job_names, args.namespace, args.timeout)
         
+    except ApiException as e:
+        print(f"❌ Kubernetes API error: {format_api_error(e)}")
+        sys.exit(1)
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)
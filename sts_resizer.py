@@ -14,193 +14,221 @@ Usage:
 """
 
 import argparse
-import subprocess
+import copy
+import json
 import sys
+import time
 import yaml
-import json
-import tempfile
-import os
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client, config
+from kubernetes.client.rest import ApiException
+
+try:
+    from yaml import CSafeDumper as _Dumper
+except ImportError as e:
+    raise ImportError(
+        "PyYAML was built without libyaml support. Reinstall it with libyaml available, e.g. "
+        "'pip install --force-reinstall --no-binary pyyaml pyyaml' after installing libyaml-dev"
+    ) from e
 
 
-def run_kubectl_command(args: list, capture_output: bool = True) -> subprocess.CompletedProcess:
-    """Run a kubectl command and return the result."""
+# Shared API client, created once per run and reused for every request
+_api_client: Optional[client.ApiClient] = None
+
+# Kubernetes-generated fields removed from manifests before recreation
+_METADATA_DROP = frozenset({'creationTimestamp', 'resourceVersion', 'uid', 'generation', 'managedFields'})
+_ANNOTATIONS_DROP = frozenset({
+    'kubectl.kubernetes.io/last-applied-configuration',
+    'deployment.kubernetes.io/revision',
+    'kubernetes.io/change-cause',
+})
+_SPEC_DROP = frozenset({
+    'currentReplicas', 'updatedReplicas', 'readyReplicas', 'availableReplicas',
+    'observedGeneration', 'collisionCount', 'conditions',
+})
+
+
+def load_cluster_config() -> client.ApiClient:
+    """Load the cluster configuration and create the shared API client.
+    
+    Credentials (including any kubeconfig exec auth plugin) are resolved here once;
+    every API call afterwards reuses the same client and its connection pool.
+    """
+    global _api_client
+    # Same precedence as kubectl: KUBECONFIG / ~/.kube/config first, in-cluster only without one
     try:
-        result = subprocess.run(['kubectl'] + args, capture_output=capture_output, text=True, check=True)
-        return result
-    except subprocess.CalledProcessError as e:
-        print(f"Error running kubectl command: {' '.join(['kubectl'] + args)}")
-        print(f"Error: {e}")
-        sys.exit(1)
+        config.load_kube_config()
+    except config.ConfigException:
+        config.load_incluster_config()
+    _api_client = client.ApiClient()
+    return _api_client
+
+
+def get_api_client() -> client.ApiClient:
+    """Return the shared API client, loading the cluster configuration on first use."""
+    if _api_client is None:
+        return load_cluster_config()
+    return _api_client
+
+
+def get_apps_api() -> client.AppsV1Api:
+    """Return an AppsV1Api bound to the shared API client."""
+    return client.AppsV1Api(get_api_client())
+
+
+def get_core_api() -> client.CoreV1Api:
+    """Return a CoreV1Api bound to the shared API client."""
+    return client.CoreV1Api(get_api_client())
+
+
+def format_api_error(error: ApiException) -> str:
+    """Return the API error status and reason, plus the server's message when it sent one."""
+    summary = f"{error.status} {error.reason}"
+    try:
+        message = json.loads(error.body).get('message') if error.body else None
+    except (ValueError, AttributeError):
+        message = None
+    return f"{summary}: {message}" if message else summary
 
 
 def get_statefulset_manifest(statefulset_name: str, namespace: str) -> Dict[str, Any]:
     """Get the current StatefulSet manifest from Kubernetes."""
     print(f"Getting manifest for StatefulSet '{statefulset_name}' in namespace '{namespace}'...")
     
-    result = run_kubectl_command(['get', 'statefulset', statefulset_name, '-n', namespace, '-o', 'yaml'])
-    return yaml.safe_load(result.stdout)
+    statefulset = get_apps_api().read_namespaced_stateful_set(statefulset_name, namespace)
+    return get_api_client().sanitize_for_serialization(statefulset)
 
 
 def create_backup(manifest: Dict[str, Any], statefulset_name: str, namespace: str) -> str:
-    """Create a backup of the StatefulSet manifest."""
+    """Write the StatefulSet manifest to a timestamped JSON backup file."""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_filename = f"{statefulset_name}_{namespace}_{timestamp}_backup.yaml"
-    
-    print(f"Creating backup: {backup_filename}")
+    backup_filename = f"{statefulset_name}_{namespace}_{timestamp}_backup.json"
     
     with open(backup_filename, 'w') as backup_file:
-        yaml.dump(manifest, backup_file, default_flow_style=False)
+        json.dump(manifest, backup_file)
     
-    print(f"✅ Backup created successfully: {backup_filename}")
     return backup_filename
 
 
-def clean_manifest(manifest: Dict[str, Any]) -> Dict[str, Any]:
-    """Clean the manifest by removing Kubernetes-generated fields."""
+def _prune_metadata(metadata: Dict[str, Any]) -> None:
+    """Remove Kubernetes-generated fields and annotations from a metadata dict (in place)."""
+    for key in _METADATA_DROP & metadata.keys():
+        del metadata[key]
+    
+    if 'annotations' in metadata:
+        annotations = {k: v for k, v in (metadata['annotations'] or {}).items() if k not in _ANNOTATIONS_DROP}
+        # Remove empty annotations section
+        if annotations:
+            metadata['annotations'] = annotations
+        else:
+            del metadata['annotations']
+
+
+def clean_manifest(manifest: Dict[str, Any], new_pv_size: Optional[str] = None) -> Dict[str, Any]:
+    """Clean the manifest (in place) and optionally resize its PVC templates, in a single pass."""
     print("Cleaning manifest by removing Kubernetes-generated fields...")
+    if new_pv_size:
+        print(f"Updating persistent volume size to: {new_pv_size}")
     
-    # Create a deep copy to avoid modifying the original
-    cleaned_manifest = yaml.safe_load(yaml.dump(manifest))
+    cleaned_manifest = manifest
     
     # Clean metadata
     if 'metadata' in cleaned_manifest:
-        metadata = cleaned_manifest['metadata']
-        # Remove fields that would prevent recreation
-        metadata.pop('creationTimestamp', None)
-        metadata.pop('resourceVersion', None)
-        metadata.pop('uid', None)
-        metadata.pop('generation', None)
-        metadata.pop('managedFields', None)
-        
-        # Clean up annotations
-        if 'annotations' in metadata:
-            annotations = metadata['annotations']
-            annotations.pop('kubectl.kubernetes.io/last-applied-configuration', None)
-            annotations.pop('deployment.kubernetes.io/revision', None)
-            annotations.pop('kubernetes.io/change-cause', None)
-            
-            # Remove empty annotations section
-            if not annotations:
-                metadata.pop('annotations')
+        _prune_metadata(cleaned_manifest['metadata'])
     
-    # Clean spec.template.metadata
-    if 'spec' in cleaned_manifest and 'template' in cleaned_manifest['spec']:
-        template_metadata = cleaned_manifest['spec']['template'].get('metadata', {})
-        template_metadata.pop('creationTimestamp', None)
-        template_metadata.pop('resourceVersion', None)
-        template_metadata.pop('uid', None)
-        template_metadata.pop('generation', None)
-        template_metadata.pop('managedFields', None)
-        
-        # Clean up template annotations
-        if 'annotations' in template_metadata:
-            template_annotations = template_metadata['annotations']
-            template_annotations.pop('kubectl.kubernetes.io/last-applied-configuration', None)
-            template_annotations.pop('deployment.kubernetes.io/revision', None)
-            template_annotations.pop('kubernetes.io/change-cause', None)
-            
-            # Remove empty annotations section
-            if not template_annotations:
-                template_metadata.pop('annotations')
-    
-    # Clean spec
     if 'spec' in cleaned_manifest:
         spec = cleaned_manifest['spec']
-        spec.pop('currentReplicas', None)
-        spec.pop('updatedReplicas', None)
-        spec.pop('readyReplicas', None)
-        spec.pop('availableReplicas', None)
-        spec.pop('observedGeneration', None)
-        spec.pop('collisionCount', None)
-        spec.pop('conditions', None)
+        
+        if 'template' in spec:
+            template = spec['template']
+            
+            # Clean spec.template.metadata
+            if 'metadata' in template:
+                _prune_metadata(template['metadata'])
+            
+            # Also check for any inline volume definitions
+            if new_pv_size and 'spec' in template:
+                for volume in template['spec'].get('volumes') or []:
+                    if 'claimName' in volume.get('persistentVolumeClaim', {}):
+                        print(f"Found inline PVC reference: {volume['persistentVolumeClaim']['claimName']}")
+                        print("Note: Inline PVCs need to be updated separately")
+        
+        # Find and update PVC templates
+        if new_pv_size:
+            for claim_template in spec.get('volumeClaimTemplates') or []:
+                requests = claim_template.get('spec', {}).get('resources', {}).get('requests', {})
+                if 'storage' in requests:
+                    old_size = requests['storage']
+                    requests['storage'] = new_pv_size
+                    print(f"Updated PVC template storage from '{old_size}' to '{new_pv_size}'")
+        
+        # Clean spec
+        for key in _SPEC_DROP & spec.keys():
+            del spec[key]
     
     # Remove status section completely
     cleaned_manifest.pop('status', None)
     
     print("✅ Manifest cleaned successfully")
+    if new_pv_size:
+        print("✅ Persistent volume size updated successfully")
     return cleaned_manifest
 
 
-def update_persistent_volume_size(manifest: Dict[str, Any], new_size: str) -> Dict[str, Any]:
-    """Update the persistent volume size in the StatefulSet manifest."""
-    print(f"Updating persistent volume size to: {new_size}")
-    
-    # Create a deep copy
-    updated_manifest = yaml.safe_load(yaml.dump(manifest))
-    
-    # Find and update PVC templates
-    if 'spec' in updated_manifest and 'volumeClaimTemplates' in updated_manifest['spec']:
-        volume_claim_templates = updated_manifest['spec']['volumeClaimTemplates']
-        
-        for template in volume_claim_templates:
-            if 'spec' in template and 'resources' in template['spec']:
-                resources = template['spec']['resources']
-                if 'requests' in resources and 'storage' in resources['requests']:
-                    old_size = resources['requests']['storage']
-                    resources['requests']['storage'] = new_size
-                    print(f"Updated PVC template storage from '{old_size}' to '{new_size}'")
-    
-    # Also check for any inline volume definitions
-    if 'spec' in updated_manifest and 'template' in updated_manifest['spec']:
-        template = updated_manifest['spec']['template']
-        if 'spec' in template and 'volumes' in template['spec']:
-            volumes = template['spec']['volumes']
-            for volume in volumes:
-                if 'persistentVolumeClaim' in volume:
-                    pvc = volume['persistentVolumeClaim']
-                    if 'claimName' in pvc:
-                        print(f"Found inline PVC reference: {pvc['claimName']}")
-                        print("Note: Inline PVCs need to be updated separately")
+def prepare_manifest(manifest: Dict[str, Any], new_pv_size: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+    """Copy the manifest once, clean and resize the copy, and return it with its YAML rendering."""
+    prepared_manifest = clean_manifest(copy.deepcopy(manifest), new_pv_size)
     
-    print("✅ Persistent volume size updated successfully")
-    return updated_manifest
+    yaml_content = yaml.dump(prepared_manifest, default_flow_style=False, Dumper=_Dumper)
+    return prepared_manifest, yaml_content
 
 
-def delete_statefulset_non_cascading(statefulset_name: str, namespace: str, dry_run: bool = False) -> None:
+def delete_statefulset_non_cascading(statefulset_name: str, namespace: str, dry_run: bool = False,
+                                     timeout_seconds: int = 120) -> None:
     """Delete the StatefulSet with non-cascading behavior (pods remain)."""
     print(f"Deleting StatefulSet '{statefulset_name}' with non-cascading behavior...")
     
     if dry_run:
-        print("🔍 DRY RUN: Would delete StatefulSet with --cascade=false")
+        print("🔍 DRY RUN: Would delete StatefulSet with propagationPolicy=Orphan")
         return
     
-    # Use --cascade=false to keep pods running
-    run_kubectl_command(['delete', 'statefulset', statefulset_name, '-n', namespace, '--cascade=false'], capture_output=False)
-    print(f"✅ StatefulSet '{statefulset_name}' deleted successfully (pods remain running)")
+    # Orphan propagation keeps pods running (equivalent to --cascade=orphan)
+    apps = get_apps_api()
+    apps.delete_namespaced_stateful_set(statefulset_name, namespace, propagation_policy='Orphan')
+    
+    # Wait for the StatefulSet to be removed so it can be recreated under the same name
+    start_time = time.time()
+    while time.time() - start_time < timeout_seconds:
+        try:
+            apps.read_namespaced_stateful_set(statefulset_name, namespace)
+        except ApiException as e:
+            if e.status == 404:
+                print(f"✅ StatefulSet '{statefulset_name}' deleted successfully (pods remain running)")
+                return
+            raise
+        time.sleep(1)
+    
+    raise TimeoutError(f"StatefulSet '{statefulset_name}' was not deleted within {timeout_seconds} seconds")
 
 
 def apply_statefulset_manifest(manifest: Dict[str, Any], namespace: str) -> None:
     """Apply the updated StatefulSet manifest."""
     print(f"Applying updated StatefulSet manifest to namespace '{namespace}'...")
     
-    # Convert to YAML
-    yaml_content = yaml.dump(manifest, default_flow_style=False)
-    
-    # Create a temporary file to store the manifest
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as temp_file:
-        temp_file.write(yaml_content)
-        temp_file_path = temp_file.name
-    
-    try:
-        # Apply using kubectl with the temporary file
-        result = run_kubectl_command(['apply', '-f', temp_file_path, '-n', namespace], capture_output=False)
-        print("✅ StatefulSet manifest applied successfully")
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+    get_apps_api().create_namespaced_stateful_set(namespace, manifest)
+    print("✅ StatefulSet manifest applied successfully")
 
 
 def get_current_pods(statefulset_name: str, namespace: str) -> list:
     """Get current pods associated with the StatefulSet."""
     print(f"Getting current pods for StatefulSet '{statefulset_name}'...")
     
-    result = run_kubectl_command(['get', 'pods', '-n', namespace, '-l', f'app={statefulset_name}', '-o', 'json'])
-    pods = json.loads(result.stdout)
+    pods = get_core_api().list_namespaced_pod(namespace, label_selector=f'app={statefulset_name}')
     
-    pod_names = [pod['metadata']['name'] for pod in pods['items']]
+    pod_names = [pod.metadata.name for pod in pods.items]
     print(f"Found {len(pod_names)} pods: {', '.join(pod_names)}")
     
     return pod_names
@@ -224,40 +252,46 @@ def main():
     print("-" * 50)
     
     try:
+        # Load cluster credentials once for the whole run
+        load_cluster_config()
+        
         # Get current StatefulSet manifest
         manifest = get_statefulset_manifest(args.statefulset_name, args.namespace)
         
-        # Create backup
-        backup_filename = create_backup(manifest, args.statefulset_name, args.namespace)
-        
-        # Clean the manifest
-        cleaned_manifest = clean_manifest(manifest)
-        
-        # Get current pods
-        current_pods = get_current_pods(args.statefulset_name, args.namespace)
-        
-        # Ask for new PV size if not provided
-        new_pv_size = args.new_pv_size
-        if not new_pv_size:
-            new_pv_size = input("Enter new persistent volume size (e.g., 100Gi): ").strip()
+        # Create backup in the background while the manifest is prepared;
+        # the original manifest is only read from here on, prepare_manifest works on a copy
+        with ThreadPoolExecutor(max_workers=1) as backup_executor:
+            print("Creating backup in the background...")
+            backup_future = backup_executor.submit(create_backup, manifest, args.statefulset_name, args.namespace)
+            
+            # Get current pods
+            current_pods = get_current_pods(args.statefulset_name, args.namespace)
+            
+            # Ask for new PV size if not provided
+            new_pv_size = args.new_pv_size
             if not new_pv_size:
-                print("No PV size provided, keeping original size")
-                new_pv_size = None
-        
-        # Update PV size if specified
-        if new_pv_size:
-            cleaned_manifest = update_persistent_volume_size(cleaned_manifest, new_pv_size)
-        
-        # Show cleaned manifest
-        print("\n📋 Cleaned manifest:")
-        print(yaml.dump(cleaned_manifest, default_flow_style=False))
+                new_pv_size = input("Enter new persistent volume size (e.g., 100Gi): ").strip()
+                if not new_pv_size:
+                    print("No PV size provided, keeping original size")
+                    new_pv_size = None
+            
+            # Clean the manifest and update PV size if specified
+            cleaned_manifest, cleaned_yaml = prepare_manifest(manifest, new_pv_size)
+            
+            # Show cleaned manifest
+            print("\n📋 Cleaned manifest:")
+            print(cleaned_yaml)
+            
+            # The backup must be on disk (or the run fails) before anything is deleted
+            backup_filename = backup_future.result()
+        print(f"✅ Backup created successfully: {backup_filename}")
         
         if args.dry_run:
             print("\n🔍 DRY RUN MODE - No changes will be made")
             print("Actions that would be performed:")
             print(f"1. ✅ Backup created: {backup_filename}")
             print(f"2. ✅ Manifest cleaned and PV size updated to: {new_pv_size or 'original'}")
-            print(f"3. 🔍 Would delete StatefulSet '{args.statefulset_name}' with --cascade=false")
+            print(f"3. 🔍 Would delete StatefulSet '{args.statefulset_name}' with propagationPolicy=Orphan")
             print(f"4. 🔍 Would apply cleaned manifest with new configuration")
             print(f"5. 🔍 Pods would remain running: {', '.join(current_pods)}")
             print("\nDry run completed. No changes were made.")
@@ -284,6 +318,9 @@ def main():
         print(f"Pods remain running: {', '.join(current_pods)}")
         print(f"New persistent volume size: {new_pv_size or 'original'}")
         
+    except ApiException as e:
+        print(f"❌ Kubernetes API error: {format_api_error(e)}")
+        sys.exit(1)
     except Exception as e:
         print(f"❌ Error: {e}")
         sys.exit(1)